@@ -2,13 +2,20 @@ import os
 import re
 import sys
 import json
+import fcntl
 import time
+import random
 import hashlib
+import functools
+import threading
+import concurrent.futures
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
+import httplib2
 from dotenv import load_dotenv
 from google.oauth2 import service_account
+import google_auth_httplib2
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
@@ -27,8 +34,14 @@ LOCK_FILE = os.getenv("LOCK_FILE", "/tmp/gs_sync.lock")
 # чтобы 5 сек не душили Google API — минимальный интервал записи в один и тот же DB лист
 MIN_WRITE_INTERVAL_SEC = int(os.getenv("MIN_WRITE_INTERVAL_SEC", "10"))
 
+# крупные листы пишем кусками, чтобы один RPC не раздувался (лимит API — 10МБ)
+WRITE_CHUNK_ROWS = int(os.getenv("WRITE_CHUNK_ROWS", "5000"))
+
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
+# компилируем один раз — крутится в горячем цикле парсинга
+_DIGIT_RE = re.compile(r"\d")
+
 
 def now_local() -> datetime:
     return datetime.now(ZoneInfo(TZ))
@@ -46,7 +59,7 @@ def current_month_name(dt: datetime) -> str:
     return months[dt.month - 1]
 
 
-def col_to_a1(n: int) -> str:
+def _compute_a1(n: int) -> str:
     s = ""
     while n:
         n, r = divmod(n - 1, 26)
@@ -54,48 +67,124 @@ def col_to_a1(n: int) -> str:
     return s
 
 
+# таблица A..ZZ (1..702) — покрывает все реальные ширины листов
+_A1 = [""] + [_compute_a1(i) for i in range(1, 703)]
+
+
+def col_to_a1(n: int) -> str:
+    return _A1[n] if 0 <= n < len(_A1) else _compute_a1(n)
+
+
 def is_valid_date_cell(v) -> bool:
-    # Google API часто отдаёт даты как строки (FORMATTED_STRING)
-    if isinstance(v, str):
-        s = v.strip()
-        # dd.MM.yyyy
-        if re.match(r"^\d{2}\.\d{2}\.\d{4}$", s):
-            return True
-        # yyyy-MM-dd (на всякий)
-        if re.match(r"^\d{4}-\d{2}-\d{2}$", s):
-            return True
+    # Google API часто отдаёт даты как строки (FORMATTED_STRING);
+    # форматы фиксированной ширины — ручная проверка дешевле regex
+    if not isinstance(v, str):
+        return False
+    s = v.strip()
+    if len(s) != 10:
+        return False
+    # dd.MM.yyyy
+    if s[2] == "." and s[5] == ".":
+        return s[:2].isdigit() and s[3:5].isdigit() and s[6:].isdigit()
+    # yyyy-MM-dd (на всякий)
+    if s[4] == "-" and s[7] == "-":
+        return s[:4].isdigit() and s[5:7].isdigit() and s[8:].isdigit()
     return False
 
 
+_FORBIDDEN = frozenset({"итого", "сотрудники", "s", "m", "дата", "менеджер", "ф.и.о", "оферты", ""})
+
+
+@functools.lru_cache(maxsize=4096)
+def _norm(s: str) -> str:
+    return s.lower().strip()
+
+
 def is_technical_word(val) -> bool:
-    v = str(val).lower().strip()
-    forbidden = {"итого", "сотрудники", "s", "m", "дата", "менеджер", "ф.и.о", "оферты"}
-    return v in forbidden or v == ""
+    return _norm(str(val)) in _FORBIDDEN
 
 
 def safe_num(x):
-    if x in ("", None):
-        return 0
-    if isinstance(x, (int, float)):
+    # частый случай — уже число; type() is дешевле isinstance
+    if type(x) is int or type(x) is float:
         return x
-    try:
-        return float(str(x).replace(",", "."))
-    except Exception:
+    if x is None or x == "":
         return 0
+    if type(x) is str:
+        try:
+            return float(x.replace(",", ".")) if "," in x else float(x)
+        except ValueError:
+            return 0
+    # bool и прочая экзотика — как раньше
+    return x if isinstance(x, (int, float)) else 0
 
 
-def get_service():
-    sa_json = os.getenv("GCP_SA_JSON")
-    if sa_json:
-        info = json.loads(sa_json)
-        creds = service_account.Credentials.from_service_account_info(info, scopes=SCOPES)
-    else:
-        creds_path = os.environ["GOOGLE_APPLICATION_CREDENTIALS"]
-        creds = service_account.Credentials.from_service_account_file(creds_path, scopes=SCOPES)
+# httplib2/HttpRequest не потокобезопасны — держим по service на поток
+_thread_local = threading.local()
+
+SYNC_POOL_SIZE = int(os.getenv("SYNC_POOL_SIZE", "8"))
+
+_creds = None
+_creds_lock = threading.Lock()
 
-    return build("sheets", "v4", credentials=creds, cache_discovery=False)
+
+def _get_credentials():
+    global _creds
+    with _creds_lock:
+        if _creds is None:
+            sa_json = os.getenv("GCP_SA_JSON")
+            if sa_json:
+                info = json.loads(sa_json)
+                _creds = service_account.Credentials.from_service_account_info(info, scopes=SCOPES)
+            else:
+                creds_path = os.environ["GOOGLE_APPLICATION_CREDENTIALS"]
+                _creds = service_account.Credentials.from_service_account_file(creds_path, scopes=SCOPES)
+        return _creds
 
 
+def get_service():
+    service = getattr(_thread_local, "service", None)
+    if service is not None:
+        return service
+
+    # постоянное keep-alive соединение (httplib2) + gzip по умолчанию:
+    # TLS-рукопожатие платится один раз на поток, а не на каждый RPC
+    authed_http = google_auth_httplib2.AuthorizedHttp(
+        _get_credentials(), http=httplib2.Http(timeout=30)
+    )
+    service = build(
+        "sheets", "v4",
+        http=authed_http,
+        cache_discovery=False,
+        static_discovery=True,
+    )
+    _thread_local.service = service
+    return service
+
+
+_RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+def _retry(fn):
+    # экспоненциальный backoff с джиттером: одиночный 429/5xx не должен
+    # ронять весь прогон
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        delay = 1.0
+        for _ in range(6):
+            try:
+                return fn(*args, **kwargs)
+            except HttpError as e:
+                if e.resp.status not in _RETRYABLE_STATUSES:
+                    raise
+                print(f"[WARN] Google API {e.resp.status}: retry через ~{delay:.0f}с")
+                time.sleep(delay + random.random())
+                delay *= 2
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+@_retry
 def read_values(service, spreadsheet_id: str, a1_range: str):
     resp = service.spreadsheets().values().get(
         spreadsheetId=spreadsheet_id,
@@ -106,6 +195,18 @@ def read_values(service, spreadsheet_id: str, a1_range: str):
     return resp.get("values", [])
 
 
+@_retry
+def read_values_batch(service, spreadsheet_id: str, ranges):
+    resp = service.spreadsheets().values().batchGet(
+        spreadsheetId=spreadsheet_id,
+        ranges=ranges,
+        valueRenderOption="UNFORMATTED_VALUE",
+        dateTimeRenderOption="FORMATTED_STRING",
+    ).execute()
+    return [vr.get("values", []) for vr in resp.get("valueRanges", [])]
+
+
+@_retry
 def clear_sheet(service, spreadsheet_id: str, sheet_name: str):
     service.spreadsheets().values().clear(
         spreadsheetId=spreadsheet_id,
@@ -114,6 +215,7 @@ def clear_sheet(service, spreadsheet_id: str, sheet_name: str):
     ).execute()
 
 
+@_retry
 def write_values(service, spreadsheet_id: str, a1_range: str, values):
     service.spreadsheets().values().update(
         spreadsheetId=spreadsheet_id,
@@ -123,25 +225,61 @@ def write_values(service, spreadsheet_id: str, a1_range: str, values):
     ).execute()
 
 
-def get_spreadsheet_metadata(service, spreadsheet_id: str):
-    return service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
+@_retry
+def clear_ranges_batch(service, spreadsheet_id: str, ranges):
+    service.spreadsheets().values().batchClear(
+        spreadsheetId=spreadsheet_id,
+        body={"ranges": list(ranges)},
+    ).execute()
+
 
+@_retry
+def write_values_batch(service, spreadsheet_id: str, items):
+    # items: список (a1_range, values)
+    service.spreadsheets().values().batchUpdate(
+        spreadsheetId=spreadsheet_id,
+        body={
+            "valueInputOption": "RAW",
+            "data": [{"range": r, "values": v} for r, v in items],
+        },
+    ).execute()
 
-def ensure_sheet_exists(service, spreadsheet_id: str, sheet_name: str):
-    meta = get_spreadsheet_metadata(service, spreadsheet_id)
-    for s in meta.get("sheets", []):
-        if s["properties"]["title"] == sheet_name:
-            return s["properties"]["sheetId"]
 
-    req = {"requests": [{"addSheet": {"properties": {"title": sheet_name}}}]}
-    resp = service.spreadsheets().batchUpdate(
+def _chunks(seq, size):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+@_retry
+def append_values(service, spreadsheet_id: str, a1_range: str, values):
+    service.spreadsheets().values().append(
+        spreadsheetId=spreadsheet_id,
+        range=a1_range,
+        valueInputOption="RAW",
+        insertDataOption="OVERWRITE",
+        body={"values": values},
+    ).execute()
+
+
+@_retry
+def get_spreadsheet_metadata(service, spreadsheet_id: str, fields: str = "sheets.properties(title,sheetId)"):
+    # без маски API отдаёт сотни КБ (форматирование, защищённые диапазоны и т.п.),
+    # а нам нужны только названия/id листов
+    return service.spreadsheets().get(spreadsheetId=spreadsheet_id, fields=fields).execute()
+
+
+@_retry
+def create_sheets_batch(service, spreadsheet_id: str, sheet_names):
+    req = {"requests": [{"addSheet": {"properties": {"title": t}}} for t in sheet_names]}
+    service.spreadsheets().batchUpdate(
         spreadsheetId=spreadsheet_id, body=req
     ).execute()
-    return resp["replies"][0]["addSheet"]["properties"]["sheetId"]
 
 
-def sheet_last_row_estimate(service, spreadsheet_id: str, sheet_name: str) -> int:
-    values = read_values(service, spreadsheet_id, f"{sheet_name}!A:A")
+def sheet_last_row_estimate(service, spreadsheet_id: str, sheet_name: str, limit: int = 2) -> int:
+    # каллеру важно лишь "есть ли данные ниже шапки" — тянем O(1) ячеек,
+    # а не весь столбец A (оценка насыщается на limit)
+    values = read_values(service, spreadsheet_id, f"{sheet_name}!A1:A{limit}")
     return len(values)
 
 
@@ -169,73 +307,100 @@ def find_header_row_and_cols(data):
         "convCol": -1,
     }
 
+    # сканируем в локальные скаляры, в info пишем один раз после цикла
+    total_col = warm_col = warm_off_col = conv_col = -1
+    digit_search = _DIGIT_RE.search
+
     for r in range(min(10, len(data))):
         row = data[r]
-        has_time = False
-        first_time_col = -1
+        time_cols = []
 
         for c in range(len(row)):
             val = str(row[c]).lower()
 
-            if (":" in val) and ("-" in val) and re.search(r"\d", val):
-                info["timeCols"].append(c)
-                if not has_time:
-                    has_time = True
-                    first_time_col = c
-
-            if "итого оферт" in val:
-                info["totalCol"] = c
-            if ("zvonobot" in val) or ("тотал теплых" in val) or ("теплых лидов" in val):
-                info["warmCol"] = c
-            if ("офферт из теплых" in val) or ("из теплых" in val) or ("от quanta" in val):
-                info["warmOffCol"] = c
-            if "конверси" in val:
-                info["convCol"] = c
-
-        if has_time:
+            if (":" in val) and ("-" in val) and digit_search(val):
+                time_cols.append(c)
+
+            # все ключевые слова не короче 8 символов — числа и короткие
+            # ячейки отсекаются одной проверкой длины
+            if len(val) >= 8:
+                if "итого оферт" in val:
+                    total_col = c
+                if ("zvonobot" in val) or ("тотал теплых" in val) or ("теплых лидов" in val):
+                    warm_col = c
+                if ("офферт из теплых" in val) or ("из теплых" in val) or ("от quanta" in val):
+                    warm_off_col = c
+                if "конверси" in val:
+                    conv_col = c
+
+        if time_cols:
             info["found"] = True
             info["rowIdx"] = r
-            info["managerCol"] = max(0, first_time_col - 1)
+            info["timeCols"] = time_cols
+            info["managerCol"] = max(0, time_cols[0] - 1)
             break
 
+    info["totalCol"] = total_col
+    info["warmCol"] = warm_col
+    info["warmOffCol"] = warm_off_col
+    info["convCol"] = conv_col
+
     return info
 
 
-def has_data(row, info) -> bool:
-    total_val = safe_num(row[info["totalCol"]]) if info["totalCol"] > -1 and info["totalCol"] < len(row) else 0
-    warm_val = safe_num(row[info["warmCol"]]) if info["warmCol"] > -1 and info["warmCol"] < len(row) else 0
+def has_data(row, total_col: int, warm_col: int, n: int) -> bool:
+    total_val = safe_num(row[total_col]) if -1 < total_col < n else 0
+    warm_val = safe_num(row[warm_col]) if -1 < warm_col < n else 0
     return (isinstance(total_val, (int, float)) and total_val > 0) or (isinstance(warm_val, (int, float)) and warm_val > 0)
 
 
-def get_val(row, idx):
-    if idx <= -1 or idx >= len(row):
+def get_val(row, idx: int, n: int):
+    if idx <= -1 or idx >= n:
         return 0
     return 0 if row[idx] in ("", None) else row[idx]
 
 
+_DB_HEADER = [
+    "Date",
+    "Manager",
+    "Time_Interval",
+    "Offers",
+    "Total_Day_Offers",
+    "Warm_Leads_Given",
+    "Offers_From_Warm",
+    "Conversion_Rate",
+]
+
+
 def build_db_result(source_values):
     data = source_values
     header = find_header_row_and_cols(data)
     if not header["found"]:
         return None, "Не удалось найти заголовки времени в листе"
 
-    result = [[
-        "Date",
-        "Manager",
-        "Time_Interval",
-        "Offers",
-        "Total_Day_Offers",
-        "Warm_Leads_Given",
-        "Offers_From_Warm",
-        "Conversion_Rate",
-    ]]
-
     current_date = None
     manager_col = header["managerCol"]
 
+    # константы внутреннего цикла — один раз, а не на каждую ячейку времени
+    time_cols = header["timeCols"]
+    hdr_row = data[header["rowIdx"]]
+    time_labels = [str(hdr_row[c]) if c < len(hdr_row) else "" for c in time_cols]
+    first_time_col = time_cols[0]
+    total_col = header["totalCol"]
+    warm_col = header["warmCol"]
+    warm_off_col = header["warmOffCol"]
+    conv_col = header["convCol"]
+
+    # преаллоцируем по верхней оценке вместо роста append'ом
+    est = (len(data) - header["rowIdx"]) * max(1, len(time_cols)) + 1
+    result = [None] * est
+    result[0] = _DB_HEADER
+    idx = 1
+
     for i in range(header["rowIdx"] + 1, len(data)):
         row = data[i]
-        cell_val = row[manager_col] if manager_col < len(row) else ""
+        n = len(row)
+        cell_val = row[manager_col] if manager_col < n else ""
         is_date = is_valid_date_cell(cell_val)
 
         if is_date:
@@ -243,63 +408,62 @@ def build_db_result(source_values):
 
         row_owner = None
 
-        if is_date and has_data(row, header):
+        if is_date and has_data(row, total_col, warm_col, n):
             row_owner = "DEPARTMENT_TOTAL"
-        elif (not str(cell_val).strip()) and current_date and has_data(row, header):
+        elif (not str(cell_val).strip()) and current_date and has_data(row, total_col, warm_col, n):
             row_owner = "DEPARTMENT_TOTAL"
         elif str(cell_val).strip() and (not is_date) and (not is_technical_word(cell_val)):
             row_owner = str(cell_val).strip()
 
         if row_owner and current_date:
-            for time_col_idx in header["timeCols"]:
-                time_label = data[header["rowIdx"]][time_col_idx] if time_col_idx < len(data[header["rowIdx"]]) else ""
-                offers = row[time_col_idx] if time_col_idx < len(row) and row[time_col_idx] not in ("", None) else 0
-
-                total = get_val(row, header["totalCol"])
-                warm_given = get_val(row, header["warmCol"])
-                warm_off = get_val(row, header["warmOffCol"])
-                conv = get_val(row, header["convCol"])
-
-                if row_owner == "DEPARTMENT_TOTAL":
-                    if time_col_idx == header["timeCols"][0]:
-                        result.append([current_date, row_owner, "ALL_DAY", offers, total, warm_given, warm_off, conv])
-                else:
-                    result.append([current_date, row_owner, str(time_label), offers, total, warm_given, warm_off, conv])
+            total = get_val(row, total_col, n)
+            warm_given = get_val(row, warm_col, n)
+            warm_off = get_val(row, warm_off_col, n)
+            conv = get_val(row, conv_col, n)
+
+            if row_owner == "DEPARTMENT_TOTAL":
+                offers = row[first_time_col] if first_time_col < n and row[first_time_col] not in ("", None) else 0
+                result[idx] = [current_date, row_owner, "ALL_DAY", offers, total, warm_given, warm_off, conv]
+                idx += 1
+            else:
+                for k, c in enumerate(time_cols):
+                    offers = row[c] if c < n and row[c] not in ("", None) else 0
+                    result[idx] = [current_date, row_owner, time_labels[k], offers, total, warm_given, warm_off, conv]
+                    idx += 1
 
+    del result[idx:]
     return result, None
 
 
 def compute_hash(values) -> str:
-    # хэшируем результат (без влияния на логику)
+    # хэшируем результат (без влияния на логику); blake2b быстрее sha256
     s = json.dumps(values, ensure_ascii=False, separators=(",", ":"))
-    return hashlib.sha256(s.encode("utf-8")).hexdigest()
+    return hashlib.blake2b(s.encode("utf-8"), digest_size=16).hexdigest()
 
 
-def state_path(sheet_name: str) -> str:
-    safe = re.sub(r"[^a-zA-Z0-9_.-]+", "_", sheet_name)
-    return f"/tmp/gs_state_{safe}.json"
+STATE_FILE = os.getenv("STATE_FILE", "/tmp/gs_sync_state.json")
 
 
-def read_state(sheet_name: str):
-    p = state_path(sheet_name)
+def read_state_file() -> dict:
+    # {db_name: {"hash": ..., "last_write_ts": ...}}
     try:
-        with open(p, "r", encoding="utf-8") as f:
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
             return json.load(f)
     except Exception:
         return {}
 
 
-def write_state(sheet_name: str, state: dict):
-    p = state_path(sheet_name)
-    with open(p, "w", encoding="utf-8") as f:
+def write_state_file(state: dict):
+    # атомарно: пишем во временный файл и заменяем
+    tmp = STATE_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(state, f)
+    os.replace(tmp, STATE_FILE)
 
 
-def should_sync_sheet(service, sheet_name: str, current_month: str) -> bool:
+def should_sync_sheet(service, sheet_name: str, current_month: str, existing_titles: set) -> bool:
     db_name = f"DB_{sheet_name}"
-    meta = get_spreadsheet_metadata(service, TARGET_SPREADSHEET_ID)
-    exists = any(s["properties"]["title"] == db_name for s in meta.get("sheets", []))
-    if not exists:
+    if db_name not in existing_titles:
         return True
     if current_month in sheet_name:
         return True
@@ -307,65 +471,70 @@ def should_sync_sheet(service, sheet_name: str, current_month: str) -> bool:
     return lr <= 1
 
 
-def sync_one(service, sheet_name: str):
+def sync_one_from_values(sheet_name: str, source_values, state: dict):
+    """Готовит payload записи для одного листа; само не пишет.
+
+    Возвращает (db_name, write_range, result, new_hash) или None, если писать нечего.
+    """
     db_name = f"DB_{sheet_name}"
 
-    # читаем исходник
-    source_values = read_values(service, SOURCE_SPREADSHEET_ID, sheet_name)
     if not source_values:
         print(f"[SKIP] SOURCE лист не найден/пустой: {sheet_name}")
-        return
+        return None
 
     result, err = build_db_result(source_values)
     if err:
         print(f"[SKIP] {sheet_name}: {err}")
-        return
+        return None
 
     # быстрый SKIP если результат не менялся
     new_hash = compute_hash(result)
-    st = read_state(db_name)
+    st = state.get(db_name, {})
     old_hash = st.get("hash")
     last_write = float(st.get("last_write_ts", 0))
 
     if old_hash == new_hash:
         print(f"[INFO] NO-CHANGE: {sheet_name} (hash same) -> skip write")
-        return
+        return None
 
     # защита от слишком частых записей
     if time.time() - last_write < MIN_WRITE_INTERVAL_SEC:
         print(f"[INFO] THROTTLE: {sheet_name} (write too soon) -> skip this round")
-        return
-
-    ensure_sheet_exists(service, TARGET_SPREADSHEET_ID, db_name)
+        return None
 
     rows = len(result)
     cols = len(result[0])
     end_a1 = f"{col_to_a1(cols)}{rows}"
     write_range = f"{db_name}!A1:{end_a1}"
 
-    clear_sheet(service, TARGET_SPREADSHEET_ID, db_name)
-    write_values(service, TARGET_SPREADSHEET_ID, write_range, result)
+    return db_name, write_range, result, new_hash
 
-    write_state(db_name, {"hash": new_hash, "last_write_ts": time.time()})
 
-    print(f"[OK] SYNC: {sheet_name} -> {db_name} ({rows}x{cols})")
+_lock_fd = None
 
 
 def acquire_lock(path: str) -> bool:
+    # flock вместо O_EXCL: ядро снимает блокировку при смерти процесса,
+    # так что после SIGKILL/краша ничего руками чистить не надо
+    global _lock_fd
+    _lock_fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o644)
     try:
-        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
-        os.write(fd, str(os.getpid()).encode())
-        os.close(fd)
+        fcntl.flock(_lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.ftruncate(_lock_fd, 0)
+        os.write(_lock_fd, str(os.getpid()).encode())
         return True
-    except FileExistsError:
+    except BlockingIOError:
+        os.close(_lock_fd)
+        _lock_fd = None
         return False
 
 
 def release_lock(path: str):
-    try:
-        os.remove(path)
-    except FileNotFoundError:
-        pass
+    global _lock_fd
+    if _lock_fd is not None:
+        fcntl.flock(_lock_fd, fcntl.LOCK_UN)
+        os.close(_lock_fd)
+        _lock_fd = None
 
 
 def main():
@@ -386,14 +555,66 @@ def main():
             print("[WARN] Settings пустой: добавь названия листов в Settings!A2:A")
             return 0
 
+        # метаданные TARGET тянем один раз, а не по разу на каждый лист
+        meta = get_spreadsheet_metadata(service, TARGET_SPREADSHEET_ID)
+        existing_titles = {s["properties"]["title"] for s in meta.get("sheets", [])}
+
         cm = current_month_name(dt)
-        for name in sheets_to_sync:
-            if should_sync_sheet(service, name, cm):
-                print(f"[INFO] SYNC: {name} -> DB_{name}")
-                sync_one(service, name)
+
+        # фильтр листов упирается в RTT (values.get на лист) —
+        # гоняем проверки параллельно, service строится per-thread
+        def _check(name):
+            return should_sync_sheet(get_service(), name, cm, existing_titles)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=SYNC_POOL_SIZE) as ex:
+            flags = list(ex.map(_check, sheets_to_sync))
+
+        to_sync = []
+        for name, ok in zip(sheets_to_sync, flags):
+            if ok:
+                to_sync.append(name)
             else:
                 print(f"[INFO] SKIP(no need): {name}")
 
+        if not to_sync:
+            return 0
+
+        # все недостающие DB_* листы создаём одним batchUpdate
+        missing = [f"DB_{n}" for n in to_sync if f"DB_{n}" not in existing_titles]
+        if missing:
+            create_sheets_batch(service, TARGET_SPREADSHEET_ID, missing)
+            existing_titles.update(missing)
+
+        # один batchGet вместо N одиночных GET — по одному RTT на весь SOURCE
+        all_values = read_values_batch(service, SOURCE_SPREADSHEET_ID, to_sync)
+        state = read_state_file()
+        payloads = []
+        for name, source_values in zip(to_sync, all_values):
+            print(f"[INFO] SYNC: {name} -> DB_{name}")
+            p = sync_one_from_values(name, source_values, state)
+            if p:
+                payloads.append(p)
+
+        # все записи в TARGET — двумя RPC (batchClear + batchUpdate),
+        # сколько бы листов ни было
+        if payloads:
+            clear_ranges_batch(service, TARGET_SPREADSHEET_ID, [db for db, _, _, _ in payloads])
+
+            # обычные листы — одним batchUpdate; крупные стримим append'ом
+            # кусками, чтобы payload отдельного RPC оставался ограниченным
+            small = [(rng, vals) for _, rng, vals, _ in payloads if len(vals) <= WRITE_CHUNK_ROWS]
+            if small:
+                write_values_batch(service, TARGET_SPREADSHEET_ID, small)
+            for db_name, _, vals, _ in payloads:
+                if len(vals) > WRITE_CHUNK_ROWS:
+                    for chunk in _chunks(vals, WRITE_CHUNK_ROWS):
+                        append_values(service, TARGET_SPREADSHEET_ID, f"{db_name}!A1", chunk)
+
+            for db_name, _, vals, new_hash in payloads:
+                state[db_name] = {"hash": new_hash, "last_write_ts": time.time()}
+                print(f"[OK] SYNC: {db_name} ({len(vals)}x{len(vals[0])})")
+            write_state_file(state)
+
         return 0
 
     except HttpError as e:
@@ -406,5 +627,22 @@ def main():
         release_lock(LOCK_FILE)
 
 
+SYNC_LOOP_INTERVAL_SEC = int(os.getenv("SYNC_LOOP_INTERVAL_SEC", "15"))
+
+
+def run_loop():
+    # демон-режим: процесс живёт между итерациями, так что креды и
+    # service (через thread-local кэш в get_service) строятся один раз,
+    # а не на каждый запуск
+    while True:
+        try:
+            main()
+        except Exception as e:
+            print("[ERROR] loop:", e)
+        time.sleep(SYNC_LOOP_INTERVAL_SEC)
+
+
 if __name__ == "__main__":
+    if os.getenv("SYNC_LOOP"):
+        run_loop()
     sys.exit(main())
\ No newline at end of file
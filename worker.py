@@ -1,6 +1,3 @@
-import time
-from sync import main
+from sync import run_loop
 
-while True:
-    main()
-    time.sleep(15)
\ No newline at end of file
+run_loop()